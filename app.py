@@ -2,6 +2,7 @@ import os
 from flask import Flask, render_template, jsonify, request
 from src.file_management import (
     AUDIO_LIBRARY_PATH,
+    compact_metadata,
     save_uploaded_file,
     get_file_details,
 )
@@ -9,6 +10,10 @@ from pyngrok import ngrok
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
+# Model sizes offered in the UI. Anything else is rejected rather than passed on
+# for the worker to try to load.
+SUPPORTED_MODELS = ("tiny", "base", "small", "medium")
+
 @app.route('/')
 def index():
     """Renders the main application page."""
@@ -27,8 +32,11 @@ def upload_recording():
     # Get destination folder and model from the form data
     destination_folder = request.form.get('destination_folder', '.')
     model = request.form.get('model', 'base') # Default to 'base' if not provided
+    if model not in SUPPORTED_MODELS:
+        return jsonify({"error": f"Unsupported model '{model}'"}), 400
+    high_accuracy = request.form.get('high_accuracy', 'false').lower() == 'true'
 
-    response, status_code = save_uploaded_file(file, destination_folder, model)
+    response, status_code = save_uploaded_file(file, destination_folder, model, high_accuracy)
     return jsonify(response), status_code
 
 @app.route('/api/file/<path:relative_path>', methods=['GET'])
@@ -60,8 +68,10 @@ if __name__ == '__main__':
 
 
     # Create the audio library directory if it doesn't exist
-    if not os.path.exists(AUDIO_LIBRARY_PATH):
-        os.makedirs(AUDIO_LIBRARY_PATH)
+    os.makedirs(AUDIO_LIBRARY_PATH, exist_ok=True)
+
+    # Fold any pending metadata changes into the snapshot before serving
+    compact_metadata()
 
     # Define the port
     port = 5000
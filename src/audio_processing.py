@@ -1,32 +1,91 @@
 import os
+import logging
 import tempfile
-import traceback
+import threading
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import ctranslate2
 import ffmpeg
-import torch
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+# Diagnostics go through logging (stderr) so that stdout carries only the transcription.
+logger = logging.getLogger(__name__)
 
 # --- 1. MODEL MANAGEMENT (LAZY LOADING) ---
 
+# GPUs below this size get int8 weights with float16 compute, which is close to
+# float16 speed at half the weight footprint (large-v3 fits in ~4GB instead of ~8GB).
+_LOW_VRAM_BYTES = 10 * 1024 ** 3
+
+def _choose_compute_type(device):
+    """Returns the CTranslate2 compute type best suited to the given device."""
+    if device != "cuda":
+        return "int8"
+    # torch is only needed to query VRAM; importing it lazily keeps it off the
+    # CPU-only startup path. CTranslate2 can see a GPU that a CPU-only torch
+    # build (or no torch at all) can't, so fall back to the compact type then.
+    try:
+        import torch
+        total_memory = torch.cuda.get_device_properties(0).total_memory
+    except (ImportError, RuntimeError, AssertionError) as e:
+        logger.warning("Could not read GPU memory through torch (%s); using int8_float16.", e)
+        return "int8_float16"
+    return "int8_float16" if total_memory < _LOW_VRAM_BYTES else "float16"
+
 class ModelContainer:
-    """A container to manage multiple transcription models, loading them lazily."""
+    """
+    A container to manage multiple transcription models, loading them lazily.
+    At most max_loaded models stay resident; the least recently used one is
+    released before loading another, so switching models doesn't stack VRAM.
+    """
     def __init__(self):
-        self._models = {}
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.compute_type = "float16" if torch.cuda.is_available() else "int8"
+        self._models = OrderedDict()
+        # Serializes loads so concurrent first requests don't load the same model twice.
+        self._lock = threading.Lock()
+        self.device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        self.compute_type = _choose_compute_type(self.device)
+        # Number of VAD chunks decoded together by the batched pipeline.
+        self.batch_size = 16 if self.device == "cuda" else 8
+        # CTranslate2 uses 4 intra-op threads unless told otherwise; on CPU let it
+        # use more of the machine. 0 keeps the library default on GPU.
+        self.cpu_threads = 0 if self.device == "cuda" else min(8, os.cpu_count() or 1)
+        default_max_loaded = 1 if self.device == "cuda" else 2
+        self.max_loaded = int(os.environ.get("WHISPER_MAX_LOADED_MODELS", default_max_loaded))
+
+    def _evict_until_room(self):
+        """Releases least recently used models until another one fits."""
+        while self._models and len(self._models) >= self.max_loaded:
+            evicted_name, _ = self._models.popitem(last=False)
+            logger.info("Unloading transcription model '%s' to free memory.", evicted_name)
 
     def load_model(self, model_name="base"):
-        """Loads a model by name. If already loaded, returns the existing instance."""
-        if model_name not in self._models:
-            print(f"Loading transcription model (faster-whisper: {model_name})...")
-            try:
-                model = WhisperModel(model_name, device=self.device, compute_type=self.compute_type)
-                self._models[model_name] = model
-                print(f"Model '{model_name}' loaded successfully.")
-            except Exception as e:
-                print(f"FATAL: Error loading transcription model '{model_name}': {e}")
-                # Don't raise here, allow fallback or error handling downstream
-                return None
-        return self._models.get(model_name)
+        """
+        Loads a model by name, wrapped in a batched inference pipeline.
+        If already loaded, returns the existing instance. Safe to call from
+        several threads.
+        """
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+            else:
+                self._evict_until_room()
+                logger.info("Loading transcription model (faster-whisper: %s, %s on %s)...",
+                            model_name, self.compute_type, self.device)
+                try:
+                    model = WhisperModel(
+                        model_name,
+                        device=self.device,
+                        compute_type=self.compute_type,
+                        cpu_threads=self.cpu_threads,
+                    )
+                    self._models[model_name] = BatchedInferencePipeline(model=model)
+                    logger.info("Model '%s' loaded successfully.", model_name)
+                except Exception:
+                    logger.exception("FATAL: Error loading transcription model '%s'", model_name)
+                    # Don't raise here, allow fallback or error handling downstream
+                    return None
+            return self._models.get(model_name)
 
 MODELS = ModelContainer()
 
@@ -48,46 +107,98 @@ def _convert_audio_to_wav(input_path):
         )
         return temp_wav
     except Exception as e:
-        print(f"Error during audio conversion: {e}")
+        # No traceback here: transcribe_audio logs it once when the error reaches it.
+        logger.error("Error during audio conversion of %s: %s", input_path, e)
         if temp_wav and os.path.exists(temp_wav):
             os.remove(temp_wav)
         raise
 
+def _is_target_wav(input_path):
+    """
+    Checks whether a file is already a 16kHz mono PCM16 WAV. Only the header
+    is read, so non-WAV inputs are rejected without decoding anything.
+    """
+    try:
+        with wave.open(input_path, 'rb') as wav:
+            return (wav.getframerate() == 16000 and wav.getnchannels() == 1
+                    and wav.getsampwidth() == 2 and wav.getcomptype() == 'NONE')
+    except (wave.Error, EOFError):
+        return False
+
+def _prepare_wav(input_path):
+    """
+    Returns (wav_path, is_temporary): the input itself if it is already a 16kHz
+    mono WAV, otherwise a temporary conversion the caller must remove.
+    """
+    if _is_target_wav(input_path):
+        logger.info("%s is already 16kHz mono PCM; skipping conversion.", input_path)
+        return input_path, False
+    return _convert_audio_to_wav(input_path), True
+
 # --- 3. CORE TRANSCRIPTION LOGIC ---
 
-def transcribe_audio(audio_path, model_name="base"):
+class TranscriptionError(Exception):
+    """Raised when a file can't be transcribed; the message is user-facing."""
+
+# Greedy decoding is several times cheaper on the decoder than beam search and is
+# good enough for quick notes; "high accuracy" requests switch back to a beam of 5.
+GREEDY_BEAM_SIZE = 1
+HIGH_ACCURACY_BEAM_SIZE = 5
+
+def transcribe_audio(audio_path, model_name="base", high_accuracy=False):
     """
     Transcribes an audio file into plain text using a specified model.
+    Uses greedy decoding unless high_accuracy is requested. Raises
+    TranscriptionError on failure.
     """
     if not audio_path or not os.path.exists(audio_path):
-        return "Error: Audio file path is missing or invalid."
+        raise TranscriptionError("Audio file path is missing or invalid.")
 
-    temp_wav_path = None
+    wav_path, is_temporary = None, False
     try:
-        # Step 1: Ensure the requested model is ready
-        transcription_model = MODELS.load_model(model_name)
-        if not transcription_model:
-            return f"Error: Could not load transcription model '{model_name}'."
-
-        # Step 2: Convert audio to a standard format
-        temp_wav_path = _convert_audio_to_wav(audio_path)
+        # Steps 1-2: Convert audio to a standard format in the background while
+        # the requested model loads. FFmpeg runs as a subprocess, so the two
+        # overlap instead of running back to back.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            wav_future = executor.submit(_prepare_wav, audio_path)
+            transcription_model = MODELS.load_model(model_name)
+            # Collect the conversion even if loading failed, so it gets cleaned up
+            wav_path, is_temporary = wav_future.result()
+            if not transcription_model:
+                raise TranscriptionError(f"Could not load transcription model '{model_name}'.")
 
         # Step 3: Transcribe audio to get segments
-        print(f"Starting transcription for {audio_path}...")
-        segments_gen, _ = transcription_model.transcribe(temp_wav_path, language="es")
+        logger.info("Starting transcription for %s...", audio_path)
+        # The batched pipeline splits the audio into VAD chunks and decodes
+        # batch_size of them per forward pass instead of one window at a time.
+        # Word timestamps are never consumed, so the alignment pass stays off.
+        # Not conditioning on previous text avoids repetition loops on long audio.
+        beam_size = HIGH_ACCURACY_BEAM_SIZE if high_accuracy else GREEDY_BEAM_SIZE
+        segments_gen, _ = transcription_model.transcribe(
+            wav_path,
+            language="es",
+            beam_size=beam_size,
+            best_of=beam_size,
+            temperature=0.0,
+            condition_on_previous_text=False,
+            vad_filter=True,
+            batch_size=MODELS.batch_size,
+        )
 
         # Step 4: Concatenate segments into a single text block
         full_transcription = " ".join(segment.text.strip() for segment in segments_gen)
 
-        print(f"Transcription for {audio_path} complete.")
+        logger.info("Transcription for %s complete.", audio_path)
         return full_transcription
 
+    except TranscriptionError:
+        raise
     except Exception as e:
-        print(f"An unexpected error occurred during transcription: {e}")
-        traceback.print_exc()
-        return f"Error during transcription: {e}"
+        # logger.exception records the traceback; the caller only gets a short message.
+        logger.exception("Transcription failed for %s", audio_path)
+        raise TranscriptionError(f"Error during transcription: {e}") from e
     finally:
         # Clean up the temporary WAV file
-        if temp_wav_path and os.path.exists(temp_wav_path):
-            os.remove(temp_wav_path)
-            print(f"Temporary file {temp_wav_path} removed.")
\ No newline at end of file
+        if is_temporary and os.path.exists(wav_path):
+            os.remove(wav_path)
+            logger.debug("Temporary file %s removed.", wav_path)
\ No newline at end of file
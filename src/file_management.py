@@ -1,89 +1,375 @@
 import os
 import json
 import shutil
-from datetime import datetime
+import stat
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # --- CONSTANTS ---
-AUDIO_LIBRARY_PATH = "audio_library"
+# Anchored to the project root so the app and the worker resolve the same
+# library whatever directory they are started from.
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AUDIO_LIBRARY_PATH = os.path.join(_PROJECT_ROOT, "audio_library")
 METADATA_FILE = os.path.join(AUDIO_LIBRARY_PATH, "metadata.json")
+# Normalized once at import; every path handed to the API must stay inside it.
+_LIBRARY_ROOT = os.path.abspath(AUDIO_LIBRARY_PATH)
+_LIBRARY_ROOT_PREFIX = _LIBRARY_ROOT + os.sep
+# Metadata keys always use forward slashes, whatever the platform separator.
+_SLASH_TRANS = str.maketrans('\\', '/')
+# Append-only change log replayed on top of METADATA_FILE. Mutations write one
+# line here instead of rewriting the whole snapshot.
+METADATA_LOG = os.path.join(AUDIO_LIBRARY_PATH, "metadata.log.jsonl")
+# Held (with flock / msvcrt.locking) around every read or write of the two
+# files above, so the app and the worker never see each other's half-done
+# compactions.
+METADATA_LOCK_FILE = os.path.join(AUDIO_LIBRARY_PATH, "metadata.lock")
+# The log is folded back into the snapshot once it is this many times larger
+# than the snapshot (and at least _COMPACT_MIN_BYTES).
+_COMPACT_RATIO = 10
+_COMPACT_MIN_BYTES = 64 * 1024
+# Number of corrupted-snapshot backups kept next to METADATA_FILE.
+_MAX_BACKUPS = 3
+# The process umask, read once at import (os.umask can only be read by setting
+# it). New snapshots get the mode a plain open() would have given them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 # --- METADATA HELPERS ---
 
-def _load_metadata():
-    """Loads the metadata file."""
-    if not os.path.exists(METADATA_FILE):
-        return {}
-    # Create backup and handle empty or corrupted file
+def _loads(raw):
+    """Parses UTF-8 encoded JSON bytes."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _dumps(data):
+    """
+    Serializes data to compact UTF-8 JSON bytes. The metadata files are only
+    read by this module, so they skip indentation, which roughly doubles their
+    size and encode time.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+# Parsed metadata is kept in memory and reused for as long as the (mtime, size)
+# stamps of the snapshot and the log are unchanged, so an unchanged load costs
+# taking the metadata lock (open + flock on the lock file) and two stat()s.
+# The worker process writes the same files, which is why the stamps are checked
+# on every load instead of trusting the cache outright.
+_META_LOCK = threading.RLock()
+_META_CACHE = {"stamp": None, "data": None}
+# Open lock file and nesting depth of _locked() in this process; guarded by _META_LOCK.
+_FILE_LOCK = {"file": None, "depth": 0}
+
+def _lock_file(f):
+    """Blocks until this process holds the exclusive lock on f."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            # LK_LOCK retries for about 10 seconds before giving up
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+@contextmanager
+def _locked():
+    """
+    Holds the metadata lock against other threads and other processes.
+    Reentrant within a thread, so locked helpers can call each other.
+    """
+    with _META_LOCK:
+        if _FILE_LOCK["depth"] == 0:
+            os.makedirs(AUDIO_LIBRARY_PATH, exist_ok=True)
+            f = open(METADATA_LOCK_FILE, 'a+b')
+            try:
+                _lock_file(f)
+            except BaseException:
+                f.close()
+                raise
+            _FILE_LOCK["file"] = f
+        _FILE_LOCK["depth"] += 1
+        try:
+            yield
+        finally:
+            _FILE_LOCK["depth"] -= 1
+            if _FILE_LOCK["depth"] == 0:
+                f = _FILE_LOCK["file"]
+                _FILE_LOCK["file"] = None
+                try:
+                    _unlock_file(f)
+                finally:
+                    f.close()
+
+def _file_stamp(path):
+    """Returns (mtime_ns, size) for a file, or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _metadata_stamp():
+    """
+    Returns the combined stamp of the snapshot and the change log. It changes
+    whenever any process records a metadata change.
+    """
+    return (_file_stamp(METADATA_FILE), _file_stamp(METADATA_LOG))
+
+def _backup_corrupted_snapshot():
+    """Copies a corrupted METADATA_FILE aside, keeping only the newest backups."""
+    shutil.copyfile(METADATA_FILE, f"{METADATA_FILE}.bak_{time.strftime('%Y%m%d%H%M%S')}")
+    directory, prefix = os.path.split(METADATA_FILE)
+    backups = sorted(name for name in os.listdir(directory) if name.startswith(prefix + ".bak_"))
+    for name in backups[:-_MAX_BACKUPS]:
+        os.remove(os.path.join(directory, name))
+
+def _read_snapshot():
+    """Reads METADATA_FILE, backing it up and starting over if it is corrupted."""
     try:
-        with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-            # Check if file is empty
-            if os.path.getsize(METADATA_FILE) == 0:
-                return {}
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        # If file is corrupted or not found, create a backup and return empty metadata
-        if os.path.exists(METADATA_FILE):
-            shutil.copyfile(METADATA_FILE, f"{METADATA_FILE}.bak_{datetime.now().strftime('%Y%m%d%H%M%S')}")
+        with open(METADATA_FILE, 'rb') as f:
+            raw = f.read()
+        return _loads(raw) if raw else {}
+    except FileNotFoundError:
         return {}
+    except ValueError:
+        # If file is corrupted, create a backup and return empty metadata
+        _backup_corrupted_snapshot()
+        return {}
+
+def _apply_change(metadata, op, key, value=None):
+    """Applies a single change record to a metadata dict."""
+    if op == "set":
+        metadata[key] = value
+    elif op == "del":
+        metadata.pop(key, None)
+
+def _replay_log(metadata):
+    """Applies every record in METADATA_LOG, in order, to metadata."""
+    try:
+        with open(METADATA_LOG, 'rb') as f:
+            for line in f:
+                try:
+                    record = _loads(line)
+                except ValueError:
+                    # A torn line from a crash mid-append. _append_change starts
+                    # the next record on a new line, so only this one is lost.
+                    continue
+                _apply_change(metadata, record.get("op"), record.get("key"), record.get("value"))
+    except FileNotFoundError:
+        pass
+
+def _load_metadata():
+    """
+    Loads the metadata snapshot with the change log applied. The returned dict
+    is shared with the cache: callers must not modify it directly and should
+    record changes with _append_change instead.
+    """
+    with _locked():
+        stamp = _metadata_stamp()
+        if _META_CACHE["stamp"] == stamp:
+            return _META_CACHE["data"]
+
+        metadata = _read_snapshot()
+        _replay_log(metadata)
+        _META_CACHE["stamp"] = stamp
+        _META_CACHE["data"] = metadata
+
+        snapshot_size = stamp[0][1] if stamp[0] else 0
+        log_size = stamp[1][1] if stamp[1] else 0
+        if log_size > max(_COMPACT_MIN_BYTES, _COMPACT_RATIO * snapshot_size):
+            _save_metadata(metadata)
+        return metadata
 
 
 def _save_metadata(metadata):
-    """Saves the metadata file."""
-    with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=4, ensure_ascii=False)
+    """
+    Writes a full snapshot and clears the change log it now contains.
+    Refreshes the in-memory cache.
+    """
+    with _locked():
+        log_stamp = _META_CACHE["stamp"][1] if _META_CACHE["stamp"] else None
+        # Write to a temporary file and rename it over the snapshot, so a crash
+        # mid-write leaves the previous snapshot intact instead of a truncated one.
+        # The name is unique per write, so no other writer can ever share it.
+        fd, temp_path = tempfile.mkstemp(
+            dir=AUDIO_LIBRARY_PATH, prefix=os.path.basename(METADATA_FILE) + ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_dumps(metadata))
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file owner-only. Keep the current snapshot's
+            # mode, or for a first snapshot the one open() would have used.
+            try:
+                mode = stat.S_IMODE(os.stat(METADATA_FILE).st_mode)
+            except FileNotFoundError:
+                mode = 0o666 & ~_UMASK
+            os.chmod(temp_path, mode)
+            os.replace(temp_path, METADATA_FILE)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        # Replaying records that are already in the snapshot is harmless, so if
+        # the log no longer matches what metadata was built from, keep it rather
+        # than dropping changes, and let the next load re-read it.
+        new_log_stamp = None
+        if log_stamp is not None and _file_stamp(METADATA_LOG) == log_stamp:
+            with open(METADATA_LOG, 'r+b') as f:
+                f.truncate(0)
+                st = os.fstat(f.fileno())
+            new_log_stamp = (st.st_mtime_ns, st.st_size)
+        if new_log_stamp is not None or log_stamp is None:
+            _META_CACHE["stamp"] = (_file_stamp(METADATA_FILE), new_log_stamp)
+            _META_CACHE["data"] = metadata
+        else:
+            _META_CACHE["stamp"] = None
+
+def _append_change(op, key, value=None):
+    """
+    Records a change ("set" with the entry's full value, or "del") by appending
+    one line to the change log, and applies it to the cached metadata.
+    """
+    record = _dumps({"op": op, "key": key, "value": value}) + b"\n"
+    with _locked():
+        metadata = _load_metadata()
+        cached_stamp = _META_CACHE["stamp"]
+        with open(METADATA_LOG, 'a+b') as f:
+            # A crash mid-append can leave a torn last line. Start on a fresh
+            # line so this record isn't glued onto it and skipped on replay.
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    record = b"\n" + record
+            f.write(record)
+            f.flush()
+            st = os.fstat(f.fileno())
+        _apply_change(metadata, op, key, value)
+
+        # Only keep the cache if the log grew by exactly our record. The file
+        # lock keeps other writers out, so this is a safeguard: on a mismatch
+        # the next load re-reads both files.
+        if cached_stamp is not None:
+            snapshot_stamp, log_stamp = cached_stamp
+            expected_size = (log_stamp[1] if log_stamp else 0) + len(record)
+            if st.st_size == expected_size:
+                _META_CACHE["stamp"] = (snapshot_stamp, (st.st_mtime_ns, st.st_size))
+                return
+        _META_CACHE["stamp"] = None
+
+def _update_entry(key, update):
+    """
+    Read-modify-write of a single metadata entry under the metadata lock.
+    update receives a copy of the current entry (empty if missing) and returns
+    the new one, which is recorded with a single log append.
+    """
+    with _locked():
+        entry = update(dict(_load_metadata().get(key, {})))
+        _append_change("set", key, entry)
+        return entry
+
+def compact_metadata():
+    """Folds the change log into the metadata snapshot."""
+    with _locked():
+        _save_metadata(_load_metadata())
+
+def _is_safe_relative(path):
+    """
+    Cheap, syscall-free check that a client-supplied path is relative and has no
+    parent references. Rejects POSIX and Windows roots ('/', '\\') as well as
+    drive prefixes like 'C:', whatever platform the server runs on.
+    """
+    return ".." not in path and not path.startswith(('/', '\\')) and path[1:2] != ':'
+
+def _is_inside_library(abs_path):
+    """
+    Checks that an absolute, normalized path is the library root or below it.
+    Comparing against the root plus a separator rejects siblings such as
+    'audio_library_evil' that a bare startswith() would let through.
+    """
+    return abs_path == _LIBRARY_ROOT or abs_path.startswith(_LIBRARY_ROOT_PREFIX)
 
 # --- API-FACING FUNCTIONS ---
 
-def save_uploaded_file(file_storage, destination_folder=".", model="base"):
+def save_uploaded_file(file_storage, destination_folder=".", model="base", high_accuracy=False):
     """
     Saves an uploaded file to a specific folder within the audio library
-    and records the selected transcription model.
+    and records the selected transcription model and decoding mode.
     """
     if not file_storage:
         return {"error": "No file provided"}, 400
 
     filename = file_storage.filename
     # Security checks for filename
-    if ".." in filename or os.path.isabs(filename):
+    if not _is_safe_relative(filename):
         return {"error": "Invalid filename"}, 400
 
     # Security checks for destination folder
-    if ".." in destination_folder or os.path.isabs(destination_folder):
+    if not _is_safe_relative(destination_folder):
         return {"error": "Invalid destination folder"}, 400
 
     # Resolve the destination path safely
-    library_root = os.path.abspath(AUDIO_LIBRARY_PATH)
-    destination_path = os.path.abspath(os.path.join(library_root, destination_folder))
+    destination_path = os.path.abspath(os.path.join(_LIBRARY_ROOT, destination_folder))
 
     # Final security check to ensure we are still inside the library
-    if not destination_path.startswith(library_root):
+    if not _is_inside_library(destination_path):
         return {"error": "Invalid destination folder"}, 400
 
     # Create the destination directory if it doesn't exist
     os.makedirs(destination_path, exist_ok=True)
 
     # Create a unique filename to avoid overwrites
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
     base, ext = os.path.splitext(filename)
     safe_filename = f"{base.replace(' ', '_')}_{timestamp}{ext}"
 
-    save_path = os.path.join(destination_path, safe_filename)
+    # The client's filename may carry './' segments; normalize so the metadata
+    # key sliced from this path has a single spelling.
+    save_path = os.path.normpath(os.path.join(destination_path, safe_filename))
 
     try:
         file_storage.save(save_path)
 
-        # Add a basic entry to metadata, now including the model
-        metadata = _load_metadata()
-        relative_path = os.path.relpath(save_path, AUDIO_LIBRARY_PATH)
-        metadata[str(relative_path).replace('\\', '/')] = {
+        # Add a basic entry to metadata, now including the model. save_path is
+        # known to be under the library root, so slicing off the prefix gives
+        # the relative path without another relpath() normalization.
+        metadata_key = save_path[len(_LIBRARY_ROOT_PREFIX):].translate(_SLASH_TRANS)
+        _append_change("set", metadata_key, {
             "status": "Processing",
-            "model": model
-        }
-        _save_metadata(metadata)
+            "model": model,
+            "high_accuracy": high_accuracy
+        })
 
         return {
             "message": f"File '{safe_filename}' uploaded successfully to '{destination_folder}'",
-            "filePath": str(relative_path).replace('\\', '/')
+            "filePath": metadata_key
         }, 201
 
     except Exception as e:
@@ -95,37 +381,38 @@ def update_transcription_metadata(file_path, transcription, status):
     """
     Updates the metadata for a specific file with its transcription and status.
     """
-    if ".." in file_path or os.path.isabs(file_path):
+    if not _is_safe_relative(file_path):
         print(f"Invalid path provided to update_transcription_metadata: {file_path}")
         return
 
-    metadata = _load_metadata()
+    def apply(entry):
+        # The entry might be new if the file was added but metadata wasn't created
+        entry["transcription"] = transcription
+        entry["status"] = status
+        return entry
 
     # The key in metadata is the relative path
-    if file_path in metadata:
-        metadata[file_path]["transcription"] = transcription
-        metadata[file_path]["status"] = status
-    else:
-        # This case might happen if the file was added but metadata wasn't created
-        metadata[file_path] = {
-            "transcription": transcription,
-            "status": status
-        }
-
-    _save_metadata(metadata)
+    _update_entry(file_path, apply)
 
 def get_file_details(relative_path):
     """
     Retrieves all available details for a single file, including its transcription.
     """
     # Security checks
-    if ".." in relative_path or os.path.isabs(relative_path):
+    if not _is_safe_relative(relative_path):
         return {"error": "Invalid file path"}, 400
 
-    library_root = os.path.abspath(AUDIO_LIBRARY_PATH)
-    full_path = os.path.abspath(os.path.join(library_root, relative_path))
+    full_path = os.path.abspath(os.path.join(_LIBRARY_ROOT, relative_path))
 
-    if not full_path.startswith(library_root) or not os.path.isfile(full_path):
+    if not _is_inside_library(full_path):
+        return {"error": "File not found"}, 404
+
+    # A single stat() both confirms the file exists and provides its size
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return {"error": "File not found"}, 404
+    if not stat.S_ISREG(st.st_mode):
         return {"error": "File not found"}, 404
 
     metadata = _load_metadata()
@@ -134,6 +421,7 @@ def get_file_details(relative_path):
     details = {
         "fileName": os.path.basename(relative_path),
         "path": relative_path,
+        "sizeBytes": st.st_size,
         "status": file_metadata.get("status", "Unknown"),
         "transcription": file_metadata.get("transcription", None),
         "spectrogram": file_metadata.get("spectrogram", None) # Placeholder for now
@@ -10,6 +10,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const modelModal = document.getElementById('model-selection-modal');
     const modelConfirmBtn = document.getElementById('model-confirm-btn');
     const modelOptions = document.querySelectorAll('.model-option');
+    const highAccuracyToggle = document.getElementById('high-accuracy-toggle');
     const closeModalBtn = document.querySelector('.modal .close-btn');
 
     // --- State Variables ---
@@ -25,14 +26,16 @@ document.addEventListener('DOMContentLoaded', () => {
      * Sends the audio file to the backend for transcription.
      * @param {File} audioFile The audio file to transcribe.
      * @param {string} model The selected transcription model.
+     * @param {boolean} highAccuracy Whether to use beam search instead of greedy decoding.
      */
-    async function transcribeAudio(audioFile, model) {
+    async function transcribeAudio(audioFile, model, highAccuracy) {
         transcriptionOutput.value = 'Transcribing... Please wait.';
         transcriptionOutput.placeholder = 'Transcribing... Please wait.';
 
         const formData = new FormData();
         formData.append('file', audioFile);
         formData.append('model', model);
+        formData.append('high_accuracy', highAccuracy ? 'true' : 'false');
         // The simplified version doesn't need a destination folder
         formData.append('destination_folder', '.');
 
@@ -164,7 +167,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     modelConfirmBtn.addEventListener('click', () => {
         if (audioFileToProcess) {
-            transcribeAudio(audioFileToProcess, selectedModel);
+            transcribeAudio(audioFileToProcess, selectedModel, highAccuracyToggle.checked);
         }
         modelModal.classList.remove('show');
     });
@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from src import file_management as fm
+
+
+class MetadataStoreTestCase(unittest.TestCase):
+    """Points the metadata store at a temporary library for each test."""
+
+    def setUp(self):
+        self.library = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.library, ignore_errors=True)
+        patcher = mock.patch.multiple(
+            fm,
+            AUDIO_LIBRARY_PATH=self.library,
+            METADATA_FILE=os.path.join(self.library, "metadata.json"),
+            METADATA_LOG=os.path.join(self.library, "metadata.log.jsonl"),
+            METADATA_LOCK_FILE=os.path.join(self.library, "metadata.lock"),
+            _LIBRARY_ROOT=self.library,
+            _LIBRARY_ROOT_PREFIX=self.library + os.sep,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._forget_cache()
+
+    def _forget_cache(self):
+        fm._META_CACHE["stamp"] = None
+        fm._META_CACHE["data"] = None
+
+
+class ReplayTests(MetadataStoreTestCase):
+
+    def test_log_is_applied_over_snapshot(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        fm.compact_metadata()
+        fm._append_change("set", "b.wav", {"status": "Processing"})
+        fm._append_change("set", "a.wav", {"status": "Completed"})
+        fm._append_change("del", "b.wav")
+        self._forget_cache()
+        self.assertEqual(fm._load_metadata(), {"a.wav": {"status": "Completed"}})
+
+    def test_torn_final_line_is_skipped(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        with open(fm.METADATA_LOG, "ab") as f:
+            f.write(b'{"op": "set", "key": "b.wav", "val')
+        self._forget_cache()
+        self.assertEqual(fm._load_metadata(), {"a.wav": {"status": "Processing"}})
+
+    def test_append_after_torn_line_is_kept(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        with open(fm.METADATA_LOG, "ab") as f:
+            f.write(b'{"op": "set", "key": "b.wav", "val')
+        fm.update_transcription_metadata("a.wav", "hello", "Completed")
+        self._forget_cache()
+        self.assertEqual(
+            fm._load_metadata(),
+            {"a.wav": {"status": "Completed", "transcription": "hello"}},
+        )
+
+
+class CompactionTests(MetadataStoreTestCase):
+
+    def test_compact_folds_log_into_snapshot(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        fm.compact_metadata()
+        self.assertEqual(os.path.getsize(fm.METADATA_LOG), 0)
+        self._forget_cache()
+        self.assertEqual(fm._read_snapshot(), {"a.wav": {"status": "Processing"}})
+        self.assertEqual(fm._load_metadata(), {"a.wav": {"status": "Processing"}})
+
+    def test_cache_stays_valid_after_compaction(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        fm.compact_metadata()
+        self.assertEqual(fm._META_CACHE["stamp"], fm._metadata_stamp())
+
+    def test_compaction_keeps_snapshot_mode(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        fm.compact_metadata()
+        os.chmod(fm.METADATA_FILE, 0o600)
+        fm._append_change("set", "b.wav", {"status": "Processing"})
+        fm.compact_metadata()
+        self.assertEqual(stat.S_IMODE(os.stat(fm.METADATA_FILE).st_mode), 0o600)
+
+    def test_first_snapshot_follows_umask(self):
+        fm._append_change("set", "a.wav", {"status": "Processing"})
+        with mock.patch.object(fm, "_UMASK", 0o077):
+            fm.compact_metadata()
+        self.assertEqual(stat.S_IMODE(os.stat(fm.METADATA_FILE).st_mode), 0o600)
+
+    def test_automatic_compaction_keeps_every_record(self):
+        with mock.patch.object(fm, "_COMPACT_MIN_BYTES", 256):
+            for i in range(200):
+                # Compaction runs when a load re-reads the files, as it does
+                # after another process has written to them.
+                self._forget_cache()
+                fm._update_entry(f"{i}.wav", lambda entry: {"status": "Processing"})
+        self.assertTrue(fm._read_snapshot())
+        self._forget_cache()
+        self.assertEqual(len(fm._load_metadata()), 200)
+
+
+class _FakeUpload:
+    """The parts of werkzeug's FileStorage that save_uploaded_file uses."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(b"audio")
+
+
+class UploadTests(MetadataStoreTestCase):
+
+    def test_key_is_normalized(self):
+        response, status_code = fm.save_uploaded_file(_FakeUpload("./rec.wav"))
+        self.assertEqual(status_code, 201)
+        key = response["filePath"]
+        self.assertRegex(key, r"^rec_\d{8}_\d{6}\.wav$")
+        self.assertIn(key, fm._load_metadata())
+
+    def test_key_uses_forward_slashes(self):
+        response, status_code = fm.save_uploaded_file(_FakeUpload("rec.wav"), "notes/./today")
+        self.assertEqual(status_code, 201)
+        self.assertTrue(response["filePath"].startswith("notes/today/rec_"))
+
+
+def _append_many(name, count):
+    # Runs in a forked child: start from an empty cache like a fresh process.
+    fm._META_CACHE["stamp"] = None
+    fm._META_CACHE["data"] = None
+    for i in range(count):
+        fm._append_change("set", f"{name}/{i}.wav", {"status": "Processing"})
+        if i % 50 == 0:
+            fm.compact_metadata()
+
+
+@unittest.skipUnless("fork" in multiprocessing.get_all_start_methods(), "needs fork")
+class ConcurrentAccessTests(MetadataStoreTestCase):
+
+    def test_concurrent_appends_and_compactions_lose_nothing(self):
+        count = 300
+        ctx = multiprocessing.get_context("fork")
+        with mock.patch.object(fm, "_COMPACT_MIN_BYTES", 512):
+            processes = [ctx.Process(target=_append_many, args=(name, count)) for name in ("app", "worker")]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+
+        self._forget_cache()
+        metadata = fm._load_metadata()
+        self.assertEqual(len(metadata), 2 * count)
+        backups = [name for name in os.listdir(self.library) if ".bak_" in name]
+        self.assertEqual(backups, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
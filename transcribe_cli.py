@@ -1,25 +1,70 @@
 import sys
 import os
+import json
 import argparse
-from src.audio_processing import transcribe_audio
+import logging
+
+def run_daemon():
+    """
+    Serves transcription requests until stdin closes, keeping loaded models in
+    memory between them. Each request is one JSON line on stdin,
+    {"path": ..., "model": ..., "high_accuracy": ...}, and each reply is one JSON
+    line on stdout: {"ok": true, "text": ...} on success or
+    {"ok": false, "error": ...} on failure.
+    """
+    from src.audio_processing import TranscriptionError, transcribe_audio
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            text = transcribe_audio(
+                request["path"],
+                model_name=request.get("model", "base"),
+                high_accuracy=request.get("high_accuracy", False),
+            )
+            reply = {"ok": True, "text": text}
+        except TranscriptionError as e:
+            reply = {"ok": False, "error": str(e)}
+        except Exception as e:
+            reply = {"ok": False, "error": f"Invalid transcription request: {e}"}
+        print(json.dumps(reply), flush=True)
 
 def main():
     """
-    Command-line interface for transcribing a single audio file.
+    Command-line interface for transcribing a single audio file, or for serving
+    many requests from one process with --daemon.
     """
     parser = argparse.ArgumentParser(description="Transcribe a single audio file.")
-    parser.add_argument("audio_path", help="The full path to the audio file.")
+    parser.add_argument("audio_path", nargs="?", help="The full path to the audio file.")
     parser.add_argument("--model", default="base", help="The transcription model to use (e.g., 'tiny', 'base', 'small').")
+    parser.add_argument("--high-accuracy", action="store_true", help="Use beam search instead of greedy decoding (slower).")
+    parser.add_argument("--daemon", action="store_true", help="Read JSON requests from stdin and answer on stdout.")
 
     args = parser.parse_args()
+    if not args.daemon and not args.audio_path:
+        parser.error("audio_path is required unless --daemon is given")
+
+    # Logs go to stderr; stdout is reserved for the transcription itself.
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format="%(levelname)s: %(message)s")
+
+    if args.daemon:
+        run_daemon()
+        return
 
     if not os.path.exists(args.audio_path):
         print(f"Error: File not found at '{args.audio_path}'", file=sys.stderr)
         sys.exit(1)
 
+    # Imported only now: loading faster-whisper and CTranslate2 takes a while,
+    # and argument or path errors shouldn't have to wait for it.
+    from src.audio_processing import transcribe_audio
+
     try:
         # Call the transcription function with the specified model
-        transcription = transcribe_audio(args.audio_path, model_name=args.model)
+        transcription = transcribe_audio(args.audio_path, model_name=args.model, high_accuracy=args.high_accuracy)
         # Print the result to standard output
         print(transcription)
     except Exception as e:
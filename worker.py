@@ -1,93 +1,269 @@
 import os
+import json
 import time
+import queue
+import threading
 import traceback
 import subprocess
 import sys
-from src.file_management import AUDIO_LIBRARY_PATH, _load_metadata, update_transcription_metadata
+from concurrent.futures import ThreadPoolExecutor
+from src.file_management import (
+    AUDIO_LIBRARY_PATH, METADATA_FILE, METADATA_LOG,
+    _load_metadata, _metadata_stamp, update_transcription_metadata,
+)
 
-def run_transcription_process(file_path, model_name="base"):
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog is optional; fall back to polling
+    FileSystemEventHandler = object
+    Observer = None
+
+# Transcriptions are served by long-lived `transcribe_cli.py --daemon` processes,
+# so models are loaded once instead of once per file. Each process keeps its
+# models in the ModelContainer LRU, which bounds how many stay resident.
+TRANSCRIBE_CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "transcribe_cli.py")
+TRANSCRIPTION_TIMEOUT = 600 # 10-minute timeout for larger models
+# Files transcribed concurrently, and the number of transcription processes.
+# Each process holds its own models, so every extra one costs another set of
+# model memory; raise it only when the GPU/CPU has room for that.
+WORKER_PARALLELISM = int(os.environ.get("WORKER_PARALLELISM", "1"))
+# Seconds between metadata checks. With watchdog installed the worker wakes on
+# file events instead, and the longer interval only covers missed events
+# (e.g. on network filesystems).
+POLL_INTERVAL = 10
+EVENT_POLL_INTERVAL = 60
+
+class TranscriptionDaemon:
     """
-    Runs the command-line transcriber in a separate process, specifying the model.
+    A transcribe_cli.py --daemon subprocess serving any model. It is started on
+    first use and restarted if it exits or has to be killed after a timeout.
+    """
+    def __init__(self):
+        self._process = None
+        self._replies = None
+        # One request at a time per process; the protocol has no request ids.
+        self._lock = threading.Lock()
+
+    def _ensure_running(self):
+        if self._process is not None and self._process.poll() is None:
+            return
+        print("Dispatcher: Starting transcription process...")
+        # stderr is inherited so the transcriber's logs show up in the worker's output
+        # without a pipe that could fill up and block it.
+        self._process = subprocess.Popen(
+            [sys.executable, "-u", TRANSCRIBE_CLI, "--daemon"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # Replies are read on a helper thread so waiting for one can time out
+        # portably (select() doesn't work on pipes on Windows).
+        self._replies = queue.Queue()
+        threading.Thread(
+            target=self._read_replies, args=(self._process.stdout, self._replies), daemon=True
+        ).start()
+
+    @staticmethod
+    def _read_replies(stdout, replies):
+        for line in stdout:
+            replies.put(line)
+        replies.put(None) # The process exited
+
+    def kill(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.kill()
+            self._process.wait()
+
+    def transcribe(self, file_path, model_name="base", high_accuracy=False, timeout=TRANSCRIPTION_TIMEOUT):
+        """
+        Sends one request and returns the reply, {"ok": True, "text": ...} or
+        {"ok": False, "error": ...}. Raises TimeoutError if no
+        reply arrives in time, after killing the process (a running transcription
+        can't be interrupted), and RuntimeError if the process dies.
+        """
+        with self._lock:
+            self._ensure_running()
+            request = {"path": file_path, "model": model_name, "high_accuracy": high_accuracy}
+            try:
+                self._process.stdin.write(json.dumps(request) + "\n")
+                self._process.stdin.flush()
+            except OSError as e:
+                raise RuntimeError(f"Transcription process is not accepting requests: {e}")
+
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    line = self._replies.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    self.kill()
+                    raise TimeoutError(f"No reply within {timeout} seconds")
+                if line is None:
+                    raise RuntimeError(f"Transcription process exited with code {self._process.wait()}")
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    reply = None
+                if isinstance(reply, dict) and "ok" in reply:
+                    return reply
+                # Not a protocol line (e.g. stray library output); keep waiting
+                print(f"Dispatcher: Ignoring unexpected output: {line.strip()}")
+
+# A fixed pool, so the number of resident transcription processes never
+# depends on which model names show up in the metadata.
+_DAEMONS = queue.Queue()
+for _ in range(WORKER_PARALLELISM):
+    _DAEMONS.put(TranscriptionDaemon())
+
+def run_transcription_process(file_path, model_name="base", high_accuracy=False):
+    """
+    Transcribes a file in one of the pooled long-lived transcription processes.
+    Returns (ok, text), where text is the transcription on success and the
+    error message otherwise.
     """
     print(f"Dispatcher: Starting transcription for {file_path} using model '{model_name}'...")
-    python_executable = sys.executable
-    command = [
-        python_executable,
-        "-u",
-        "transcribe_cli.py",
-        file_path,
-        "--model",
-        model_name
-    ]
-
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # The dispatcher runs at most WORKER_PARALLELISM jobs, so one is always free.
+    daemon = _DAEMONS.get()
 
     try:
-        stdout, stderr = process.communicate(timeout=600) # 10-minute timeout for larger models
+        reply = daemon.transcribe(file_path, model_name, high_accuracy)
+    except TimeoutError:
+        print(f"Dispatcher: Transcription for {file_path} timed out.")
+        return False, "Transcription failed: Process timed out."
+    except RuntimeError as e:
+        print(f"Dispatcher: Transcription process for {file_path} failed. {e}")
+        return False, f"Transcription failed: {e}"
+    except Exception as e:
+        print(f"Dispatcher: An unexpected error occurred. {e}")
+        return False, f"Dispatcher error: {e}"
+    finally:
+        _DAEMONS.put(daemon)
+
+    if not reply["ok"]:
+        print(f"Dispatcher: Transcription for {file_path} failed. {reply.get('error')}")
+        return False, f"Transcription failed: {reply.get('error')}"
+    print(f"Dispatcher: Transcription for {file_path} finished.")
+    return True, reply.get("text", "").strip()
+
+def _process_one(recording_data):
+    """
+    Transcribes one pending recording and stores the result in the metadata.
+    Runs on the dispatcher's thread pool. Always leaves the entry 'Completed' or
+    'Failed', so it isn't picked up again.
+    """
+    relative_path = recording_data['path']
+    model = recording_data.get('model', 'base') # Default to 'base'
+    high_accuracy = recording_data.get('high_accuracy', False)
+    absolute_path = os.path.join(AUDIO_LIBRARY_PATH, relative_path)
 
-        if process.returncode == 0:
-            print(f"Dispatcher: Transcription for {file_path} succeeded.")
-            return stdout.strip()
+    try:
+        if os.path.exists(absolute_path):
+            ok, transcription = run_transcription_process(absolute_path, model, high_accuracy)
         else:
-            error_message = stderr.strip()
-            print(f"Dispatcher: Transcription process for {file_path} failed. Stderr: {error_message}")
-            return f"Transcription failed: {error_message}"
-
-    except subprocess.TimeoutExpired:
-        process.kill()
-        stdout, stderr = process.communicate()
-        print(f"Dispatcher: Transcription for {file_path} timed out. Stderr: {stderr.strip()}")
-        return "Transcription failed: Process timed out."
+            print(f"Warning: File '{relative_path}' found in metadata but not on disk.")
+            ok, transcription = False, "Transcription failed: File not found on disk."
+        status = "Completed" if ok else "Failed"
+
+        update_transcription_metadata(relative_path, transcription, status)
+        print(f"Dispatcher: Updated metadata for {relative_path}. Status: {status}.")
     except Exception as e:
-        process.kill()
-        print(f"Dispatcher: An unexpected error occurred. {e}")
-        return f"Dispatcher error: {e}"
+        print(f"An error occurred while processing {relative_path}: {e}", file=sys.stderr)
+        traceback.print_exc()
+
+class _MetadataEventHandler(FileSystemEventHandler):
+    """Sets wake whenever the metadata snapshot or change log is touched."""
+    _WATCHED = frozenset({os.path.abspath(METADATA_FILE), os.path.abspath(METADATA_LOG)})
+
+    def __init__(self, wake):
+        super().__init__()
+        self._wake = wake
+
+    def on_any_event(self, event):
+        # Snapshot writes arrive as a move of the temp file onto metadata.json.
+        paths = (event.src_path, getattr(event, "dest_path", ""))
+        if any(os.path.abspath(os.fsdecode(path)) in self._WATCHED for path in paths if path):
+            self._wake.set()
+
+def _start_metadata_watcher(wake):
+    """
+    Starts a watchdog observer on the library folder, if watchdog is available.
+    Returns the poll interval to use alongside it.
+    """
+    if Observer is None:
+        return POLL_INTERVAL
+    try:
+        os.makedirs(AUDIO_LIBRARY_PATH, exist_ok=True)
+        observer = Observer()
+        observer.daemon = True
+        observer.schedule(_MetadataEventHandler(wake), AUDIO_LIBRARY_PATH, recursive=False)
+        observer.start()
+    except Exception as e:
+        print(f"Dispatcher: Could not watch {AUDIO_LIBRARY_PATH} ({e}); polling instead.", file=sys.stderr)
+        return POLL_INTERVAL
+    print("Dispatcher: Watching metadata for changes.")
+    return EVENT_POLL_INTERVAL
+
+def _schedule_pending(executor, in_flight):
+    """
+    Submits every file marked 'Processing' that isn't already in flight.
+    """
+    all_metadata = _load_metadata()
+    files_to_process = []
+    for path, data in all_metadata.items():
+        # Ensure the item is a file with a 'status' key
+        if isinstance(data, dict) and data.get('status') == 'Processing' and path not in in_flight:
+            # Add path to a copy of the data so we can use it later
+            # without touching the cached metadata entry
+            files_to_process.append({**data, 'path': path})
+
+    if files_to_process:
+        print(f"Dispatcher: Found {len(files_to_process)} file(s) to process.")
+        for recording_data in files_to_process:
+            in_flight[recording_data['path']] = executor.submit(_process_one, recording_data)
+    else:
+        # This message is useful for debugging to know the worker is alive.
+        # print("Dispatcher: No pending files found.")
+        pass
 
 def main():
     """
     Main worker loop that scans for and processes files based on metadata.
+    Up to WORKER_PARALLELISM files are transcribed at once.
     """
     print("--- Audio Processing Dispatcher Started ---")
     print("Watching for files to process. Press Ctrl+C to exit.")
 
+    executor = ThreadPoolExecutor(max_workers=WORKER_PARALLELISM)
+    # Set by metadata file events to cut the wait short.
+    wake = threading.Event()
+    poll_interval = _start_metadata_watcher(wake)
+    # Files already handed to the pool, so later scans don't schedule them again
+    # while they are still marked 'Processing'.
+    in_flight = {}
+    # Stamp of the metadata files at the last scan. While it is unchanged there
+    # is nothing new to schedule, so an idle tick costs two stat() calls instead
+    # of a scan. Finished jobs record their result, which changes the stamp;
+    # a job finishing on its own never triggers a rescan, so an entry that
+    # somehow stays 'Processing' can't be resubmitted in a tight loop.
+    last_stamp = None
+
     while True:
         try:
-            all_metadata = _load_metadata()
-            files_to_process = []
-            for path, data in all_metadata.items():
-                # Ensure the item is a file with a 'status' key
-                if isinstance(data, dict) and data.get('status') == 'Processing':
-                    # Add path to the data so we can use it later
-                    data['path'] = path
-                    files_to_process.append(data)
-
-            if files_to_process:
-                print(f"Dispatcher: Found {len(files_to_process)} file(s) to process.")
-                for recording_data in files_to_process:
-                    relative_path = recording_data['path']
-                    model = recording_data.get('model', 'base') # Default to 'base'
-                    absolute_path = os.path.join(AUDIO_LIBRARY_PATH, relative_path)
-
-                    if not os.path.exists(absolute_path):
-                        print(f"Warning: File '{relative_path}' found in metadata but not on disk. Skipping.")
-                        continue
-
-                    transcription = run_transcription_process(absolute_path, model)
-
-                    status = "Completed" if "failed" not in transcription.lower() and "error" not in transcription.lower() else "Failed"
-
-                    update_transcription_metadata(relative_path, transcription, status)
-                    print(f"Dispatcher: Updated metadata for {relative_path}. Status: {status}.")
-            else:
-                # This message is useful for debugging to know the worker is alive.
-                # print("Dispatcher: No pending files found.")
-                pass
+            for path in [path for path, future in in_flight.items() if future.done()]:
+                del in_flight[path]
+
+            stamp = _metadata_stamp()
+            if stamp != last_stamp:
+                _schedule_pending(executor, in_flight)
+                # Only a scan that completed counts; if it raised, retry next tick.
+                last_stamp = stamp
 
         except Exception as e:
             print(f"An error occurred in the main dispatcher loop: {e}", file=sys.stderr)
             traceback.print_exc()
 
-        time.sleep(10)
+        wake.wait(poll_interval)
+        wake.clear()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file